@@ -5,6 +5,7 @@ from jax import jit
 from attitude.primitives import MiscUtil
 
 
+@jit
 def get_B(w: jnp.ndarray, v_b_set: jnp.ndarray, v_n_set: jnp.ndarray) -> jnp.ndarray:
     """ Generate the intermediate B matrix for davenport's q method. Heading vectors should
         be unit vectors.
@@ -17,7 +18,22 @@ def get_B(w: jnp.ndarray, v_b_set: jnp.ndarray, v_n_set: jnp.ndarray) -> jnp.nda
     Returns:
         jnp.ndarray: B matrix
     """
-    return sum([w[i] * jnp.outer(v_b_set[i], v_n_set[i]) for i in range(w.shape[0])])
+    return jnp.einsum('n,ni,nj->ij', w, v_b_set, v_n_set)
+
+
+def _build_K(sigma: float, S: jnp.ndarray, Z: jnp.ndarray) -> jnp.ndarray:
+    """ Assemble the K matrix from its parts.
+
+    Args:
+        sigma (float): trace of B.
+        S (jnp.ndarray): 3x3 matrix S = B + B^T.
+        Z (jnp.ndarray): 1x3 matrix Z from B.
+
+    Returns:
+        jnp.ndarray: K matrix
+    """
+    return jnp.zeros((4, 4)).at[0, 0].set(sigma).at[0, 1:].set(Z).at[1:, 0].set(Z)\
+        .at[1:, 1:].set(S - jnp.eye(3) * sigma)
 
 
 def get_K(w: jnp.ndarray, v_b_set: jnp.ndarray, v_n_set: jnp.ndarray) -> jnp.ndarray:
@@ -35,9 +51,8 @@ def get_K(w: jnp.ndarray, v_b_set: jnp.ndarray, v_n_set: jnp.ndarray) -> jnp.nda
     B = get_B(w, v_b_set, v_n_set)
     sigma = jnp.trace(B)
     S = B + B.T
-    Z = jnp.expand_dims(MiscUtil.antisym_dcm_vector(B), axis=-1)
-
-    return jnp.block([[sigma, Z.T], [Z, S - jnp.eye(3) * sigma]])
+    Z = MiscUtil.antisym_dcm_vector(B)
+    return _build_K(sigma, S, Z)
 
 
 def get_g(beta: jnp.ndarray, w: jnp.ndarray, v_b_set: jnp.ndarray, v_n_set: jnp.ndarray) -> float:
@@ -1,46 +1,121 @@
 """ QUEST Method implementation
 """
-from jax import jit, grad
-from jax.lax import while_loop
+from functools import partial
+from jax import jit, vmap
+from jax.lax import fori_loop
 import jax.numpy as jnp
-from attitude.determination.davenport import get_K, get_B
+from attitude.determination.davenport import get_B, _build_K
 from attitude.primitives import MiscUtil
 
-def K_eig_eq(x: float, K: jnp.ndarray) -> float:
-    """ Eigenvalue equation for K matrix.  To be optimized with 
-        respect to lam.
+
+def _quest_coeffs(S: jnp.ndarray, Z: jnp.ndarray, sigma: float) -> tuple:
+    """ Coefficients of the QUEST characteristic quartic (Shuster):
+        a = sigma^2 - trace(adj(S)), b = sigma^2 + Z.Z, 
+        c = det(S) + Z.S.Z, d = Z.S^2.Z
+
+    Args:
+        S (jnp.ndarray): 3x3 matrix S = B + B^T.
+        Z (jnp.ndarray): 1x3 matrix Z from B.
+        sigma (float): trace of B.
+
+    Returns:
+        tuple: quartic coefficients (a, b, c, d).
+    """
+    # For 3x3 S, trace(adj(S)) is the sum of the principal 2x2 minors.
+    kappa = 0.5 * (jnp.trace(S)**2. - jnp.trace(S @ S))
+    a = sigma**2. - kappa
+    b = sigma**2. + jnp.dot(Z, Z)
+    c = jnp.linalg.det(S) + Z @ S @ Z
+    d = Z @ (S @ S) @ Z
+    return a, b, c, d
+
+
+def K_eig_eq(x: float, coeffs: tuple, sigma: float) -> float:
+    """ Eigenvalue equation for K matrix, written as the closed form QUEST 
+        quartic.  To be optimized with respect to lam.
 
     Args:
         x (float): eigenvalue.
-        K (jnp.ndarray): K matrix from Davenport's method.
+        coeffs (tuple): quartic coefficients (a, b, c, d) from _quest_coeffs.
+        sigma (float): trace of B.
 
     Returns:
         float: Value of eigenvalue polynomial equation. 
     """
-    return jnp.linalg.det(K - x * jnp.eye(K.shape[0]))
+    a, b, c, d = coeffs
+    # Horner form of x^4 - (a + b)x^2 - cx + (ab + c sigma - d).
+    return ((x * x - (a + b)) * x - c) * x + (a * b + c * sigma - d)
+
+
+def grad_K_eig_eq(x: float, coeffs: tuple) -> float:
+    """ Analytic derivative of K_eig_eq with respect to x.
+
+    Args:
+        x (float): eigenvalue.
+        coeffs (tuple): quartic coefficients (a, b, c, d) from _quest_coeffs.
+
+    Returns:
+        float: Derivative of eigenvalue polynomial equation. 
+    """
+    a, b, c, _ = coeffs
+    # Horner form of 4x^3 - 2(a + b)x - c.
+    return (4. * x * x - 2. * (a + b)) * x - c
 
 
-def get_lam(w: jnp.ndarray, K: jnp.ndarray, e: float=1e-15) -> float:
+@partial(jit, static_argnames=('n_iter',))
+def get_lam(w: jnp.ndarray, coeffs: tuple, sigma: float, *, n_iter: int=8) -> float:
     """ Use simple Newton-Raphson method to iterate for lam with initial guess 
-        equal to the sum of the weights w. Function should be jitable. 
+        equal to the sum of the weights w.  A fixed number of iterations is run 
+        so the function is jitable and vmapable without a batched while loop. 
+
+    Args:
+        w (jnp.ndarray): N matrix with weights.
+        coeffs (tuple): quartic coefficients (a, b, c, d) from _quest_coeffs.
+        sigma (float): trace of B.
+        n_iter (int, optional): Keyword only. Number of Newton iterations. 
+            Defaults to 8.
+
+    Returns:
+        float: Largest eigenvalue of K.
+    """
+    body_func = lambda i, x: x - K_eig_eq(x, coeffs, sigma) / grad_K_eig_eq(x, coeffs)
+    return fori_loop(0, n_iter, body_func, jnp.sum(w))
+
+
+@partial(jit, static_argnames=('n_iter',))
+def get_lam_power(w: jnp.ndarray, K: jnp.ndarray, n_iter: int=10) -> float:
+    """ Use shifted inverse power iteration with a fixed number of steps to find 
+        lam, with only matrix-vector products inside the loop.  The shift mu is 
+        just above the sum of the weights w, which bounds every eigenvalue of K, 
+        so the largest eigenvalue of K is the one closest to mu and the dominant 
+        eigenvalue of (mu I - K)^-1.  Convergence is geometric in the ratio 
+        (mu - lam) / (mu - lam_2), which is small whenever the measurements are 
+        consistent (lam close to the sum of w).  Function should be jitable and 
+        vmapable. 
 
     Args:
         w (jnp.ndarray): N matrix with weights.
         K (jnp.ndarray): K matrix from Davenport's method
-        e (float, optional): Desired precision. Defaults to 1e-16.
+        n_iter (int, optional): Number of power iterations. Defaults to 10.
 
     Returns:
         float: Largest eigenvalue of K.
     """
-    lam0 = jnp.array([jnp.sum(w), jnp.sum(w) + 1.])
-    grad_K_eig_eq  = grad(K_eig_eq)
-    body_func = lambda x: jnp.array([x[0] - K_eig_eq(x[0], K) / grad_K_eig_eq(x[0], K), x[0]]) 
-    cond_func = lambda x: jnp.abs(x[0] - x[1]) > e
-    return while_loop(cond_func, body_func, lam0)[0]
+    # The small offset keeps mu I - K invertible when lam equals the sum of w.
+    mu = jnp.sum(w) * (1. + 1e-3)
+    M = jnp.linalg.inv(mu * jnp.eye(4) - K)
+
+    def body_func(i, v):
+        v = M @ v
+        return v / jnp.linalg.norm(v)
+
+    v = fori_loop(0, n_iter, body_func, jnp.full(4, 0.5))
+    return v @ K @ v
 
 
+@partial(jit, static_argnames=('n_iter',))
 def get_q(
-        w: jnp.ndarray,  v_b_set: jnp.ndarray, v_n_set: jnp.ndarray, e: float=1e-15
+        w: jnp.ndarray,  v_b_set: jnp.ndarray, v_n_set: jnp.ndarray, *, n_iter: int=8
     ) -> jnp.ndarray:
     """ Get CRP q parameters from sensor heading and weights. 
 
@@ -48,7 +123,8 @@ def get_q(
         w (jnp.ndarray): N matrix with weights.
         v_b_set (jnp.ndarray): Nx3 matrix of N body frame headings from each sensor.
         v_n_set (jnp.ndarray): Nx3 matrix of N inertial frame headings from each sensor.
-        e (float, optional): Desired precision. Defaults to 1e-16.
+        n_iter (int, optional): Keyword only. Number of Newton iterations for lam. 
+            Defaults to 8.
 
     Returns:
         jnp.ndarray: 1x3 q parameter matrix.
@@ -56,14 +132,20 @@ def get_q(
     B = get_B(w, v_b_set, v_n_set)
     S = B + B.T
     sigma = jnp.trace(B)
-    Z = jnp.expand_dims(MiscUtil.antisym_dcm_vector(B), axis=-1)
-    K = jnp.block([[sigma, Z.T], [Z, S - jnp.eye(3) * sigma]])
-    lam = get_lam(w, K, e=e)
-    return jnp.matmul(jnp.linalg.inv((lam + sigma) * jnp.eye(3) - S), Z).flatten()
+    Z = MiscUtil.antisym_dcm_vector(B)
+    coeffs = _quest_coeffs(S, Z, sigma)
+    lam = get_lam(w, coeffs, sigma, n_iter=n_iter)
+    # q is very sensitive to lam near 180 deg rotations, and in float32 the 
+    # quartic residual is only good to about an ulp of lam. One final Newton 
+    # step with the residual taken as det(K - lam I) recovers that ulp.
+    K = _build_K(sigma, S, Z)
+    lam = lam - jnp.linalg.det(K - lam * jnp.eye(4)) / grad_K_eig_eq(lam, coeffs)
+    return jnp.linalg.solve((lam + sigma) * jnp.eye(3) - S, Z)
 
 
+@partial(jit, static_argnames=('n_iter',))
 def get_b(
-        w: jnp.ndarray,  v_b_set: jnp.ndarray, v_n_set: jnp.ndarray, e: float=1e-15
+        w: jnp.ndarray,  v_b_set: jnp.ndarray, v_n_set: jnp.ndarray, *, n_iter: int=8
     ) -> jnp.ndarray:
     """ Get Euler parameters b from sensor heading and weights. 
 
@@ -71,11 +153,32 @@ def get_b(
         w (jnp.ndarray): N matrix with weights.
         v_b_set (jnp.ndarray): Nx3 matrix of N body frame headings from each sensor.
         v_n_set (jnp.ndarray): Nx3 matrix of N inertial frame headings from each sensor.
-        e (float, optional): Desired precision. Defaults to 1e-16.
+        n_iter (int, optional): Keyword only. Number of Newton iterations for lam. 
+            Defaults to 8.
 
     Returns:
         jnp.ndarray: 1x4 b parameter matrix.
     """
-    q = get_q(w, v_b_set, v_n_set, e=e)
-    q2 = jnp.dot(q, q)
-    return jnp.array(1., q[0], q[1], q[2]) / jnp.sqrt(1. + q2)
\ No newline at end of file
+    q = get_q(w, v_b_set, v_n_set, n_iter=n_iter)
+    norm = jnp.sqrt(1. + jnp.dot(q, q))
+    return jnp.concatenate([jnp.ones(1), q]) / norm
+
+
+@partial(jit, static_argnames=('n_iter',))
+def get_q_batched(
+        w: jnp.ndarray,  v_b_set: jnp.ndarray, v_n_set: jnp.ndarray, *, n_iter: int=8
+    ) -> jnp.ndarray:
+    """ Batched get_q: solves M sets of sensor headings and weights in one kernel.
+        n_iter is shared by every set and is not batched. 
+
+    Args:
+        w (jnp.ndarray): MxN matrix with weights.
+        v_b_set (jnp.ndarray): MxNx3 matrix of body frame headings.
+        v_n_set (jnp.ndarray): MxNx3 matrix of inertial frame headings.
+        n_iter (int, optional): Keyword only. Number of Newton iterations for lam. 
+            Defaults to 8.
+
+    Returns:
+        jnp.ndarray: Mx3 q parameter matrix.
+    """
+    return vmap(partial(get_q, n_iter=n_iter))(w, v_b_set, v_n_set)
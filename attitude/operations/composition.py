@@ -1,25 +1,31 @@
+from functools import partial
 import jax.numpy as jnp
-from jax import jit
-
-@jit
-def compose_quat(b_p: jnp.ndarray, b_pp: jnp.ndarray) -> jnp.ndarray:
-    """ Adds Euler parameters directly via matrix multiplication:
+from jax import jit, vmap
+from jax.lax import cond
+from attitude.quaternions import QuaternionBatch
+from attitude.rodrigues import CRPBatch, MRPBatch
+
+@partial(jit, static_argnames=('dtype',))
+def compose_quat(b_p: jnp.ndarray, b_pp: jnp.ndarray, dtype=None) -> jnp.ndarray:
+    """ Adds Euler parameters directly via the Hamilton product:
         Q(b) = Q(b_pp)Q(b_p) for quaternion rotation matrix Q. 
 
     Args:
         b_p (jnp.ndarray): First rotation parameters 1x4 matrix.
         b_pp (jnp.ndarray): second rotation parameters 1x4 matrix.
+        dtype (jnp.dtype, optional): dtype to cast inputs to, e.g. jnp.bfloat16 
+            for batched ML pipelines. Defaults to None, which keeps the input dtype.
 
     Returns:
         jnp.ndarray: Addition of rotation parameters as 1x4 matrix.
     """
-    matrix = jnp.array(
-        [[b_pp[0], -b_pp[1], -b_pp[2], -b_pp[3]],
-         [b_pp[1], b_pp[0], b_pp[3], -b_pp[2]],
-         [b_pp[2], -b_pp[3], b_pp[0], b_pp[1]],
-         [b_pp[3], b_pp[2], -b_pp[1], b_pp[0]]]
-    )
-    return jnp.matmul(matrix, b_p.reshape((4, 1))).flatten()
+    b_p = jnp.asarray(b_p, dtype=dtype)
+    b_pp = jnp.asarray(b_pp, dtype=dtype)
+    c0 = b_pp[0] * b_p[0] - b_pp[1] * b_p[1] - b_pp[2] * b_p[2] - b_pp[3] * b_p[3]
+    c1 = b_pp[1] * b_p[0] + b_pp[0] * b_p[1] + b_pp[3] * b_p[2] - b_pp[2] * b_p[3]
+    c2 = b_pp[2] * b_p[0] - b_pp[3] * b_p[1] + b_pp[0] * b_p[2] + b_pp[1] * b_p[3]
+    c3 = b_pp[3] * b_p[0] + b_pp[2] * b_p[1] - b_pp[1] * b_p[2] + b_pp[0] * b_p[3]
+    return jnp.stack([c0, c1, c2, c3])
 
 @jit
 def compose_crp(q_p: jnp.ndarray, q_pp: jnp.ndarray) -> jnp.ndarray:
@@ -37,6 +43,7 @@ def compose_crp(q_p: jnp.ndarray, q_pp: jnp.ndarray) -> jnp.ndarray:
     denom = 1. - jnp.dot(q_p, q_pp)
     return num / denom
 
+@jit
 def relative_crp(q: jnp.ndarray, q_p: jnp.ndarray) -> jnp.ndarray:
     """ Compose CRP parameters directly in the following order:
         R(q_pp) = R(q_p)R(q)^-1 for CRP rotation matrix R. 
@@ -47,9 +54,12 @@ def relative_crp(q: jnp.ndarray, q_p: jnp.ndarray) -> jnp.ndarray:
     Returns:
         jnp.ndarray: Relative CRP parameters as 1x3 matrix.
     """
-    return compose_crp(-q_p, q)
+    # compose_crp(-q_p, q) with the sign of q_p absorbed.
+    num = jnp.add(jnp.subtract(q, q_p), jnp.cross(q, q_p))
+    denom = 1. + jnp.dot(q_p, q)
+    return num / denom
 
-# @jit
+@jit
 def compose_mrp(s_p: jnp.ndarray, s_pp: jnp.ndarray, tol=1e-2) -> jnp.ndarray:
     """ Compose MRP parameters direclty in the following order:
         R(s) = R(s_pp)R(s_p) for MRP rotation matrix R. If the denominator 
@@ -66,24 +76,23 @@ def compose_mrp(s_p: jnp.ndarray, s_pp: jnp.ndarray, tol=1e-2) -> jnp.ndarray:
     """
     dot_p = jnp.dot(s_p, s_p)
     dot_pp = jnp.dot(s_pp, s_pp)
+    sh_p = shadow_s(s_p)
+    sh_pp = shadow_s(s_pp)
     test_denom = 1. + dot_p * dot_pp - 2. * jnp.dot(s_p, s_pp)
-    # Nested where functions allow for this to be jitified. 
-    # First check is if the test_denom is less than the tolerance. If so, 
-    # then the second check gets shadow set of s_p if |s_p|>|s_pp|.  
-    # Otherwise, the shadow set of s_pp is used. 
-    return jnp.where(
-        test_denom < tol,
-        ((1. - dot_pp) * s_p + (1. - dot_p) * s_pp - 2. * jnp.cross(s_pp, s_p)) /\
-              (1. + dot_p * dot_pp - 2. * jnp.dot(s_p, s_pp)),
-        jnp.where(
-            dot_p > dot_pp,
-            ((1. - dot_pp) * shadow_s(s_p) + (1. - 1. / dot_p) * s_pp - 2. * jnp.cross(s_pp, shadow_s(s_p))) /\
-                  (1. + dot_pp / dot_p - 2. * jnp.dot(shadow_s(s_p), s_pp)), 
-            ((1. - 1. / dot_pp) * s_p + (1. - dot_p) * shadow_s(s_pp) - 2. * jnp.cross(shadow_s(s_pp), s_p)) /\
-                  (1. + dot_p / dot_pp - 2. * jnp.dot(s_p, shadow_s(s_pp))), 
-        )
-    )
+    # All three candidates are straight-line and cheap, so compute each once 
+    # and pick one with a single select. The shadow set of s_p is used if 
+    # the denominator is small and |s_p|>|s_pp|, otherwise that of s_pp. 
+    cand_normal = ((1. - dot_pp) * s_p + (1. - dot_p) * s_pp - 2. * jnp.cross(s_pp, s_p)) /\
+        test_denom
+    cand_shadow_p = ((1. - dot_pp) * sh_p + (1. - 1. / dot_p) * s_pp - 2. * jnp.cross(s_pp, sh_p)) /\
+        (1. + dot_pp / dot_p - 2. * jnp.dot(sh_p, s_pp))
+    cand_shadow_pp = ((1. - 1. / dot_pp) * s_p + (1. - dot_p) * sh_pp - 2. * jnp.cross(sh_pp, s_p)) /\
+        (1. + dot_p / dot_pp - 2. * jnp.dot(s_p, sh_pp))
+    mask_normal = test_denom >= tol
+    mask_shadow_p = dot_p > dot_pp
+    return jnp.select([mask_normal, mask_shadow_p], [cand_normal, cand_shadow_p], default=cand_shadow_pp)
 
+@jit
 def relative_mrp(s: jnp.ndarray, s_p: jnp.ndarray, tol=1e-2) -> jnp.ndarray:
     """ Compose MRP parameters directly in the following order:
         R(s_pp) = R(s_p)R(s)^-1 for MRP rotation matrix R. 
@@ -96,7 +105,20 @@ def relative_mrp(s: jnp.ndarray, s_p: jnp.ndarray, tol=1e-2) -> jnp.ndarray:
     Returns:
         jnp.ndarray: Relative MRP parameters as 1x3 matrix.
     """
-    return compose_mrp(-s_p, s, tol=tol)
+    dot_s = jnp.dot(s, s)
+    dot_p = jnp.dot(s_p, s_p)
+    denom = 1. + dot_p * dot_s + 2. * jnp.dot(s_p, s)
+
+    # compose_mrp(-s_p, s) with the sign of s_p absorbed. lax.cond traces both 
+    # branches but only runs the shadow switch when the denominator is small; 
+    # under vmap the cond becomes a select and both branches run.
+    def direct(_):
+        return ((1. - dot_p) * s - (1. - dot_s) * s_p + 2. * jnp.cross(s, s_p)) / denom
+
+    def shadow(_):
+        return compose_mrp(-s_p, s, tol=tol)
+
+    return cond(denom >= tol, direct, shadow, None)
 
 @jit
 def shadow_s(s: jnp.ndarray) -> jnp.ndarray:
@@ -108,4 +130,117 @@ def shadow_s(s: jnp.ndarray) -> jnp.ndarray:
     Returns:
         jnp.ndarray: 1x3 matrix of s shadow parameters.
     """
-    return -s / jnp.dot(s, s)
\ No newline at end of file
+    return -s / jnp.dot(s, s)
+
+# Batched entry points: map over a leading axis of N parameter sets so N
+# compositions are dispatched as a single kernel.
+@partial(jit, static_argnames=('dtype',))
+def compose_quat_batched(b_p: jnp.ndarray, b_pp: jnp.ndarray, dtype=None) -> jnp.ndarray:
+    """ Batched compose_quat over N pairs of rotations. 
+
+    Args:
+        b_p (jnp.ndarray): First rotation parameters as Nx4 matrix.
+        b_pp (jnp.ndarray): Second rotation parameters as Nx4 matrix.
+        dtype (jnp.dtype, optional): dtype to cast inputs to, e.g. jnp.bfloat16. 
+            Defaults to None, which keeps the input dtype.
+
+    Returns:
+        jnp.ndarray: Addition of rotation parameters as Nx4 matrix.
+    """
+    return vmap(partial(compose_quat, dtype=dtype))(b_p, b_pp)
+
+compose_crp_batched = jit(vmap(compose_crp))
+
+
+# Structure of arrays (SoA) compositions: every component of a batch is its own 
+# (N,) array, so the formulas below are pointwise over N with no strided gathers.
+@jit
+def compose_quat_soa(b_p: QuaternionBatch, b_pp: QuaternionBatch) -> QuaternionBatch:
+    """ Batched compose_quat on SoA quaternion batches:
+        Q(b) = Q(b_pp)Q(b_p) for quaternion rotation matrix Q. 
+
+    Args:
+        b_p (QuaternionBatch): First rotation parameters for N rotations.
+        b_pp (QuaternionBatch): Second rotation parameters for N rotations.
+
+    Returns:
+        QuaternionBatch: Addition of rotation parameters for N rotations.
+    """
+    return QuaternionBatch(
+        b_pp.b0 * b_p.b0 - b_pp.b1 * b_p.b1 - b_pp.b2 * b_p.b2 - b_pp.b3 * b_p.b3,
+        b_pp.b1 * b_p.b0 + b_pp.b0 * b_p.b1 + b_pp.b3 * b_p.b2 - b_pp.b2 * b_p.b3,
+        b_pp.b2 * b_p.b0 - b_pp.b3 * b_p.b1 + b_pp.b0 * b_p.b2 + b_pp.b1 * b_p.b3,
+        b_pp.b3 * b_p.b0 + b_pp.b2 * b_p.b1 - b_pp.b1 * b_p.b2 + b_pp.b0 * b_p.b3
+    )
+
+@jit
+def compose_crp_soa(q_p: CRPBatch, q_pp: CRPBatch) -> CRPBatch:
+    """ Batched compose_crp on SoA CRP batches:
+        R(q) = R(q_pp)R(q_p) for CRP rotation matrix R. 
+
+    Args:
+        q_p (CRPBatch): First CRP parameters for N rotations.
+        q_pp (CRPBatch): Second CRP parameters for N rotations.
+
+    Returns:
+        CRPBatch: Composed CRP parameters for N rotations.
+    """
+    denom = 1. - (q_p.q0 * q_pp.q0 + q_p.q1 * q_pp.q1 + q_p.q2 * q_pp.q2)
+    return CRPBatch(
+        (q_pp.q0 + q_p.q0 - (q_pp.q1 * q_p.q2 - q_pp.q2 * q_p.q1)) / denom,
+        (q_pp.q1 + q_p.q1 - (q_pp.q2 * q_p.q0 - q_pp.q0 * q_p.q2)) / denom,
+        (q_pp.q2 + q_p.q2 - (q_pp.q0 * q_p.q1 - q_pp.q1 * q_p.q0)) / denom
+    )
+
+def _mrp_soa_formula(x: tuple, y: tuple) -> tuple:
+    """ MRP composition formula R(y)R(x) on SoA components without any 
+        shadow switch. 
+
+    Args:
+        x (tuple): First MRP components as three N matrices.
+        y (tuple): Second MRP components as three N matrices.
+
+    Returns:
+        tuple: Composed MRP components as three N matrices.
+    """
+    dot_x = x[0] * x[0] + x[1] * x[1] + x[2] * x[2]
+    dot_y = y[0] * y[0] + y[1] * y[1] + y[2] * y[2]
+    denom = 1. + dot_x * dot_y - 2. * (x[0] * y[0] + x[1] * y[1] + x[2] * y[2])
+    cross = (
+        y[1] * x[2] - y[2] * x[1],
+        y[2] * x[0] - y[0] * x[2],
+        y[0] * x[1] - y[1] * x[0]
+    )
+    return tuple(
+        ((1. - dot_y) * x[i] + (1. - dot_x) * y[i] - 2. * cross[i]) / denom
+        for i in range(3)
+    )
+
+@jit
+def compose_mrp_soa(s_p: MRPBatch, s_pp: MRPBatch, tol=1e-2) -> MRPBatch:
+    """ Batched compose_mrp on SoA MRP batches:
+        R(s) = R(s_pp)R(s_p) for MRP rotation matrix R.  The shadow switch 
+        is applied per rotation exactly as in compose_mrp. 
+
+    Args:
+        s_p (MRPBatch): First MRP parameters for N rotations.
+        s_pp (MRPBatch): Second MRP parameters for N rotations.
+        tol (float): Tolerance for shadow switch.
+
+    Returns:
+        MRPBatch: Composed MRP parameters for N rotations.
+    """
+    x = (s_p.s0, s_p.s1, s_p.s2)
+    y = (s_pp.s0, s_pp.s1, s_pp.s2)
+    dot_p = x[0] * x[0] + x[1] * x[1] + x[2] * x[2]
+    dot_pp = y[0] * y[0] + y[1] * y[1] + y[2] * y[2]
+    test_denom = 1. + dot_p * dot_pp - 2. * (x[0] * y[0] + x[1] * y[1] + x[2] * y[2])
+    cand_normal = _mrp_soa_formula(x, y)
+    cand_shadow_p = _mrp_soa_formula(tuple(-c / dot_p for c in x), y)
+    cand_shadow_pp = _mrp_soa_formula(x, tuple(-c / dot_pp for c in y))
+    mask_normal = test_denom >= tol
+    mask_shadow_p = dot_p > dot_pp
+    return MRPBatch(*(
+        jnp.select([mask_normal, mask_shadow_p], [n, p], default=pp)
+        for n, p, pp in zip(cand_normal, cand_shadow_p, cand_shadow_pp)
+    ))
@@ -1,29 +1,40 @@
-from attitude.primitives import Primitive
+from attitude.primitives import Primitive, MiscUtil
 import jax.numpy as jnp
+from jax import jit
+from jax.tree_util import register_pytree_node_class
 
 class Quaternion(Primitive):
     """ quaternion rotation object. b0 is the scalar part and must 
         be the first element of the input tuple b. 
     """
-    def __init__(self, b: jnp.ndarray) -> None:
+    def __init__(self, b: jnp.ndarray, dtype=None) -> None:
         """
 
         Args:
             b (jnp.ndarray): 1x4 matrix of quaternion parameters. First component
-                is the scalar component
+                is the scalar component. Should have unit length; it is 
+                normalized on construction.
+            dtype (jnp.dtype, optional): dtype to cast b to, e.g. jnp.float64 
+                (requires jax_enable_x64). Defaults to None, which keeps the input dtype.
         
         Attributes:
-            b (jnp.ndarray): 1x4 matrix of quaternion parameters. First component
+            b (jnp.ndarray): 1x4 matrix of unit quaternion parameters. First component
                 is the scalar component
         """
         super().__init__()
-        assert jnp.abs(jnp.linalg.norm(jnp.asarray(b)) - 1.) < 1e-7, 'Elements of b must have unit length.'
+        # Normalize instead of asserting unit length, which would force a 
+        # device to host sync and fail under jit.
+        b = jnp.asarray(b, dtype=dtype)
+        b = b / jnp.linalg.norm(b)
         self.b = b
         self.dcm = self._build_quanterion(b)
 
     
-    def _build_quanterion(self, b: jnp.ndarray) -> jnp.ndarray:
-        """ Builds dcm from quaternion parameters. 
+    @staticmethod
+    @jit
+    def _build_quanterion(b: jnp.ndarray) -> jnp.ndarray:
+        """ Builds dcm from quaternion parameters as 
+            (b0^2 - v.v)I + 2vv^T - 2b0[v x] with vector part v = (b1, b2, b3). 
 
         Args:
             b (jnp.ndarray): 1x4 matrix parameters. First component
@@ -32,13 +43,11 @@ class Quaternion(Primitive):
         Returns:
             jnp.ndarray: dcm derived from buanternion parameters b. 
         """
-        b0, b1, b2, b3 = b.tolist()
+        b = jnp.asarray(b)
+        b0, v = b[0], b[1:]
 
-        return jnp.array(
-            [[b0**2. + b1**2. - b2**2. - b3**2., 2. * (b1 * b2 + b0 * b3), 2. * (b1 * b3 - b0 * b2)],
-            [2. * (b1 * b2 - b0 * b3), b0**2. - b1**2. + b2**2. - b3**2., 2. * (b2 * b3 + b0 * b1)],
-            [2. * (b1 * b3 + b0 * b2), 2. * (b2 * b3 - b0 * b1), b0**2. - b1**2. - b2**2. + b3**2.]]
-        )
+        return (b0**2. - jnp.dot(v, v)) * jnp.eye(3, dtype=b.dtype) + 2. * jnp.outer(v, v) \
+            - 2. * b0 * MiscUtil.cross_prod_oper(v)
     
     def get_PVR_from_b(self) -> tuple: 
         """ Generates PVR directly from b.
@@ -78,3 +87,52 @@ class Quaternion(Primitive):
              self.b[3] / (1. + self.b[0])]
         )
 
+
+@register_pytree_node_class
+class QuaternionBatch(object):
+    """ Structure of arrays batch of N quaternions.  Each component is stored 
+        as its own (N,) array so batched operations are pointwise over N. 
+        b0 is the scalar part. 
+    """
+    def __init__(
+            self, b0: jnp.ndarray, b1: jnp.ndarray, b2: jnp.ndarray, b3: jnp.ndarray
+        ) -> None:
+        """
+
+        Args:
+            b0 (jnp.ndarray): N matrix of scalar components.
+            b1 (jnp.ndarray): N matrix of first vector components.
+            b2 (jnp.ndarray): N matrix of second vector components.
+            b3 (jnp.ndarray): N matrix of third vector components.
+        """
+        self.b0 = b0
+        self.b1 = b1
+        self.b2 = b2
+        self.b3 = b3
+
+    @classmethod
+    def from_array(cls, b: jnp.ndarray):
+        """ Builds batch from stacked quaternion parameters.
+
+        Args:
+            b (jnp.ndarray): Nx4 matrix of quaternion parameters. 
+
+        Returns:
+            QuaternionBatch: new batch instance.
+        """
+        return cls(b[:, 0], b[:, 1], b[:, 2], b[:, 3])
+
+    def to_array(self) -> jnp.ndarray:
+        """ Stacks batch components back into quaternion parameters.
+
+        Returns:
+            jnp.ndarray: Nx4 matrix of quaternion parameters.
+        """
+        return jnp.stack([self.b0, self.b1, self.b2, self.b3], axis=-1)
+
+    def tree_flatten(self) -> tuple:
+        return (self.b0, self.b1, self.b2, self.b3), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
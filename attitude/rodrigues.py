@@ -1,6 +1,7 @@
 """ CRP: Classical Rodrigues Parameters. 
 """
 import jax.numpy as jnp
+from jax.tree_util import register_pytree_node_class
 from attitude.primitives import Primitive
 
 class CRP(Primitive):
@@ -61,6 +62,51 @@ class CRP(Primitive):
         return self.__class__(-self.q)
 
 
+@register_pytree_node_class
+class CRPBatch(object):
+    """ Structure of arrays batch of N CRP parameter sets.  Each component 
+        is stored as its own (N,) array so batched operations are pointwise over N. 
+    """
+    def __init__(self, q0: jnp.ndarray, q1: jnp.ndarray, q2: jnp.ndarray) -> None:
+        """
+
+        Args:
+            q0 (jnp.ndarray): N matrix of first components.
+            q1 (jnp.ndarray): N matrix of second components.
+            q2 (jnp.ndarray): N matrix of third components.
+        """
+        self.q0 = q0
+        self.q1 = q1
+        self.q2 = q2
+
+    @classmethod
+    def from_array(cls, q: jnp.ndarray):
+        """ Builds batch from stacked CRP parameters.
+
+        Args:
+            q (jnp.ndarray): Nx3 matrix of CRP q parameters. 
+
+        Returns:
+            CRPBatch: new batch instance.
+        """
+        return cls(q[:, 0], q[:, 1], q[:, 2])
+
+    def to_array(self) -> jnp.ndarray:
+        """ Stacks batch components back into CRP parameters.
+
+        Returns:
+            jnp.ndarray: Nx3 matrix of CRP q parameters.
+        """
+        return jnp.stack([self.q0, self.q1, self.q2], axis=-1)
+
+    def tree_flatten(self) -> tuple:
+        return (self.q0, self.q1, self.q2), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+
 class MRP(Primitive):
     """ Classical Rodrigues parameter rotation class.
     """
@@ -125,4 +171,48 @@ class MRP(Primitive):
             MRP: new instance inverse MRP. 
         """
         return self.__class__(-self.s)
-    
+
+
+@register_pytree_node_class
+class MRPBatch(object):
+    """ Structure of arrays batch of N MRP parameter sets.  Each component 
+        is stored as its own (N,) array so batched operations are pointwise over N. 
+    """
+    def __init__(self, s0: jnp.ndarray, s1: jnp.ndarray, s2: jnp.ndarray) -> None:
+        """
+
+        Args:
+            s0 (jnp.ndarray): N matrix of first components.
+            s1 (jnp.ndarray): N matrix of second components.
+            s2 (jnp.ndarray): N matrix of third components.
+        """
+        self.s0 = s0
+        self.s1 = s1
+        self.s2 = s2
+
+    @classmethod
+    def from_array(cls, s: jnp.ndarray):
+        """ Builds batch from stacked MRP parameters.
+
+        Args:
+            s (jnp.ndarray): Nx3 matrix of MRP s parameters. 
+
+        Returns:
+            MRPBatch: new batch instance.
+        """
+        return cls(s[:, 0], s[:, 1], s[:, 2])
+
+    def to_array(self) -> jnp.ndarray:
+        """ Stacks batch components back into MRP parameters.
+
+        Returns:
+            jnp.ndarray: Nx3 matrix of MRP s parameters.
+        """
+        return jnp.stack([self.s0, self.s1, self.s2], axis=-1)
+
+    def tree_flatten(self) -> tuple:
+        return (self.s0, self.s1, self.s2), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
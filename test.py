@@ -1,13 +1,21 @@
 import unittest
 from attitude.primitives import R1, R2, R3, Primitive, DCM
 from attitude.eulerangles import EulerAngle
-from attitude.quaternions import Quaternion
-from attitude.rodrigues import CRP, MRP
-from attitude.operations.composition import compose_quat, relative_crp, compose_mrp
+from attitude.quaternions import Quaternion, QuaternionBatch
+from attitude.rodrigues import CRP, MRP, CRPBatch, MRPBatch
+from attitude.operations.composition import (
+    compose_quat, compose_quat_batched, compose_quat_soa, compose_crp, relative_crp,
+    compose_mrp, relative_mrp, compose_crp_batched, compose_crp_soa, compose_mrp_soa
+)
+from attitude.operations.evolution import (
+    evolve_CRP, evolve_MRP, evolve_quat, evolve_quat_batched,
+    evolve_CRP_donate, evolve_MRP_donate, evolve_quat_donate
+)
 from attitude.determination.triad import get_triad_dcm
 from attitude.determination.davenport import get_K
-from attitude.determination.quest import get_q
+from attitude.determination.quest import get_q, get_q_batched, get_b, get_lam_power
 import jax.numpy as jnp
+import numpy as np
 
 class TestPrimitives(unittest.TestCase):
     """ Test for basic rotation matrices.
@@ -128,6 +136,12 @@ class TestQuaternions(unittest.TestCase):
                     msg='Error in quaternion calcuation.'
                 )
     
+    def test_quaternion_dtype(self):
+        b = jnp.array([0.235702, 0.471405, -0.471405, 0.707107])
+        test = Quaternion(b, dtype=jnp.bfloat16)
+        self.assertEqual(test.b.dtype, jnp.bfloat16)
+        self.assertEqual(test.dcm.dtype, jnp.bfloat16)
+
     def test_get_q(self):
         R = [[-0.529403, -0.474115, 0.703525],
              [-0.467056, -0.529403, -0.708231],
@@ -222,6 +236,82 @@ class TestCompositions(unittest.TestCase):
                 msg='Error in direct quaternion composition.'
             )
     
+    def test_compose_quat_batched(self):
+        b_p = jnp.array([0.774597, 0.258199, 0.516398, 0.258199])
+        b_p /= jnp.linalg.norm(b_p)
+        b_pp = jnp.array([0.359211, -0.898027, -0.179605, -0.179605])
+        b_pp /= jnp.linalg.norm(b_pp)
+
+        test_b = compose_quat_batched(jnp.stack([b_p, b_pp]), jnp.stack([b_pp, b_p]))
+        target_b = jnp.stack([compose_quat(b_p, b_pp), compose_quat(b_pp, b_p)])
+        for i in range(2):
+            for j in range(4):
+                self.assertAlmostEqual(
+                    test_b[i, j], target_b[i, j],
+                    msg='Error in batched quaternion composition.'
+                )
+
+    def test_compose_quat_dtype(self):
+        b_p = jnp.array([0.774597, 0.258199, 0.516398, 0.258199])
+        b_pp = jnp.array([0.359211, -0.898027, -0.179605, -0.179605])
+
+        self.assertEqual(compose_quat(b_p, b_pp, dtype=jnp.bfloat16).dtype, jnp.bfloat16)
+        test_b = compose_quat_batched(
+            jnp.stack([b_p, b_pp]), jnp.stack([b_pp, b_p]), dtype=jnp.bfloat16
+        )
+        self.assertEqual(test_b.dtype, jnp.bfloat16)
+        target_b = compose_quat_batched(jnp.stack([b_p, b_pp]), jnp.stack([b_pp, b_p]))
+        for i in range(2):
+            for j in range(4):
+                self.assertAlmostEqual(
+                    float(test_b[i, j]), float(target_b[i, j]), places=2,
+                    msg='Error in bfloat16 batched quaternion composition.'
+                )
+
+    def test_compose_quat_soa(self):
+        b_p = jnp.array([0.774597, 0.258199, 0.516398, 0.258199])
+        b_p /= jnp.linalg.norm(b_p)
+        b_pp = jnp.array([0.359211, -0.898027, -0.179605, -0.179605])
+        b_pp /= jnp.linalg.norm(b_pp)
+
+        test_b = compose_quat_soa(
+            QuaternionBatch.from_array(jnp.stack([b_p, b_pp])),
+            QuaternionBatch.from_array(jnp.stack([b_pp, b_p]))
+        ).to_array()
+        target_b = jnp.stack([compose_quat(b_p, b_pp), compose_quat(b_pp, b_p)])
+        for i in range(2):
+            for j in range(4):
+                self.assertAlmostEqual(
+                    test_b[i, j], target_b[i, j],
+                    msg='Error in SoA quaternion composition.'
+                )
+
+    def test_compose_crp_soa(self):
+        q_p = jnp.array([[0.1, 0.2, 0.3], [-0.3, 0.3, 0.1], [1.5, -0.4, 0.2]])
+        q_pp = jnp.array([[-0.3, 0.3, 0.1], [0.1, 0.2, 0.3], [0.2, 0.7, -1.1]])
+        test_q = compose_crp_soa(CRPBatch.from_array(q_p), CRPBatch.from_array(q_pp)).to_array()
+        target_q = compose_crp_batched(q_p, q_pp)
+        for i in range(3):
+            for j in range(3):
+                self.assertAlmostEqual(
+                    test_q[i, j], target_q[i, j], places=6,
+                    msg='Error in SoA CRP composition.'
+                )
+
+    def test_compose_mrp_soa(self):
+        # Rows hit the regular formula, the s_p shadow set and the s_pp 
+        # shadow set, in that order.
+        s_p = jnp.array([[0.1, 0.2, 0.3], [0.9, 0.3, 0.3], [0.85, 0.3, 0.3]])
+        s_pp = jnp.array([[0.5, 0.3, 0.1], [0.85, 0.3, 0.3], [0.9, 0.3, 0.3]])
+        test_s = compose_mrp_soa(MRPBatch.from_array(s_p), MRPBatch.from_array(s_pp)).to_array()
+        for i in range(3):
+            target_s = compose_mrp(s_p[i], s_pp[i])
+            for j in range(3):
+                self.assertAlmostEqual(
+                    test_s[i, j], target_s[j], places=6,
+                    msg='Error in SoA MRP composition.'
+                )
+
     def test_compose_CRP(self):
         q1 = jnp.array([0.1, 0.2, 0.3])
         q2 = jnp.array([-0.3,0.3,0.1])
@@ -233,11 +323,43 @@ class TestCompositions(unittest.TestCase):
                 msg='Error in direct CRP q composition.'
             )
 
+    def test_relative_crp(self):
+        pairs = [
+            (jnp.array([-0.3, 0.3, 0.1]), jnp.array([0.1, 0.2, 0.3])),
+            (jnp.array([1.5, -0.4, 0.2]), jnp.array([0.2, 0.7, -1.1])),
+            # 1 + q_p.q is small here.
+            (jnp.array([0.9, 0.3, 0.3]), jnp.array([-1.0, -0.3, -0.3]))
+        ]
+        for q, q_p in pairs:
+            test_q = relative_crp(q, q_p)
+            target_q = compose_crp(-q_p, q)
+            for i in range(3):
+                self.assertAlmostEqual(
+                    test_q[i], target_q[i], places=5,
+                    msg='Error in relative CRP q calculation.'
+                )
+
+    def test_relative_mrp(self):
+        pairs = [
+            (jnp.array([0.5, 0.3, 0.1]), jnp.array([0.1, 0.2, 0.3])),
+            # The denominator is below tol, so the shadow switch is used.
+            (jnp.array([0.85, 0.3, 0.3]), jnp.array([-0.9, -0.3, -0.3])),
+            (jnp.array([0.9, 0.3, 0.3]), jnp.array([-0.85, -0.3, -0.3]))
+        ]
+        for s, s_p in pairs:
+            test_s = relative_mrp(s, s_p)
+            target_s = compose_mrp(-s_p, s)
+            for i in range(3):
+                self.assertAlmostEqual(
+                    test_s[i], target_s[i], places=6,
+                    msg='Error in relative MRP s calculation.'
+                )
+
     def test_compose_MRP(self):
         s1 = jnp.array([0.1, 0.2, 0.3])
         s2 = jnp.array([0.5, 0.3, 0.1])
         test_s = compose_mrp(s1, s2)
-        target_s = jnp.array([-0.16015896, 0.41617954, 0.5295768])
+        target_s = jnp.array([0.46163848, 0.86866057, 0.18335503])
         for i in range(3):
             self.assertAlmostEqual(
                 test_s[i], target_s[i],
@@ -245,6 +367,104 @@ class TestCompositions(unittest.TestCase):
             )
 
 
+class TestEvolution(unittest.TestCase):
+    """ Test attitude rate ODEs against their kinematic matrix form.
+    """
+    def test_evolve_CRP(self):
+        q = jnp.array([0.1, 0.4, -0.7])
+        omega_dot = jnp.array([0.3, -0.2, 0.5])
+        m = jnp.array(
+            [[1. + q[0]**2., q[0] * q[1] - q[2], q[0] * q[2] + q[1]],
+             [q[0] * q[1] + q[2], 1. + q[1]**2., q[1] * q[2] - q[0]],
+             [q[0] * q[2] - q[1], q[1] * q[2] + q[0], 1. + q[2]**2.]]
+        ) * 0.5
+        target = jnp.dot(m, omega_dot)
+        for shape in [(3,), (1, 3), (3, 1)]:
+            test = evolve_CRP(omega_dot.reshape(shape), q)
+            self.assertEqual(test.shape, (3,))
+            for i in range(3):
+                self.assertAlmostEqual(
+                    test[i], target[i], msg='Error in CRP rate calculation.'
+                )
+
+    def test_evolve_MRP(self):
+        s = jnp.array([0.1, 0.4, -0.7])
+        omega_dot = jnp.array([0.3, -0.2, 0.5])
+        dot_s = jnp.dot(s, s)
+        m = jnp.array(
+            [[1. - dot_s + 2. * s[0]**2., 2. * (s[0] * s[1] - s[2]), 2. * (s[0] * s[2] + s[1])],
+             [2. * (s[0] * s[1] + s[2]), 1. - dot_s + 2. * s[1]**2., 2. * (s[1] * s[2] - s[0])], 
+             [2. * (s[0] * s[2] - s[1]), 2. * (s[1] * s[2] + s[0]), 1. - dot_s + 2. * s[2]**2.]]
+        ) * 0.25
+        target = jnp.dot(m, omega_dot)
+        for shape in [(3,), (1, 3), (3, 1)]:
+            test = evolve_MRP(omega_dot.reshape(shape), s)
+            self.assertEqual(test.shape, (3,))
+            for i in range(3):
+                self.assertAlmostEqual(
+                    test[i], target[i], msg='Error in MRP rate calculation.'
+                )
+
+
+    def test_evolve_quat(self):
+        b = jnp.array([0.5, 0.5, 0.5, 0.5])
+        omega_dot = jnp.array([0.3, -0.2, 0.5])
+        m = jnp.array(
+            [[b[0], -b[1], -b[2], -b[3]],
+             [b[1], b[0], -b[3], b[2]],
+             [b[2], b[3], b[0], -b[1]],
+             [b[3], -b[2], b[1], b[0]]]
+        ) * 0.5
+        target = jnp.dot(m, jnp.array([0., 0.3, -0.2, 0.5]))
+        # (1, 3) rates were the only shape accepted before the scalar rewrite.
+        for shape in [(3,), (1, 3), (3, 1)]:
+            test = evolve_quat(omega_dot.reshape(shape), b)
+            self.assertEqual(test.shape, (4,))
+            for i in range(4):
+                self.assertAlmostEqual(
+                    test[i], target[i], msg='Error in quaternion rate calculation.'
+                )
+
+
+    def test_evolve_quat_batched_dtype(self):
+        b = jnp.array([[0.5, 0.5, 0.5, 0.5], [1., 0., 0., 0.]])
+        omega_dot = jnp.array([[0.3, -0.2, 0.5], [0.1, 0.2, 0.3]])
+        test = evolve_quat_batched(omega_dot, b, dtype=jnp.bfloat16)
+        self.assertEqual(test.dtype, jnp.bfloat16)
+        for i in range(2):
+            target = evolve_quat(omega_dot[i], b[i])
+            for j in range(4):
+                self.assertAlmostEqual(
+                    float(test[i, j]), float(target[j]), places=2,
+                    msg='Error in bfloat16 batched quaternion rate calculation.'
+                )
+
+    def test_evolve_donate(self):
+        omega_dot = jnp.array([0.3, -0.2, 0.5])
+        cases = [
+            (evolve_CRP, evolve_CRP_donate, jnp.array([0.1, -0.2, 0.3])),
+            (evolve_MRP, evolve_MRP_donate, jnp.array([0.1, -0.2, 0.3])),
+            (evolve_quat, evolve_quat_donate, jnp.array([0.5, 0.5, 0.5, 0.5]))
+        ]
+        for evolve, evolve_donate, x in cases:
+            target = evolve(omega_dot, x)
+            # Donated buffers may be invalidated, so pass fresh copies.
+            test = evolve_donate(omega_dot, jnp.array(x))
+            self.assertEqual(test.dtype, target.dtype)
+            for i in range(len(target)):
+                self.assertAlmostEqual(
+                    float(test[i]), float(target[i]),
+                    msg='Error in donating rate calculation.'
+                )
+            test = evolve_donate(omega_dot, jnp.array(x), dtype=jnp.bfloat16)
+            self.assertEqual(test.dtype, jnp.bfloat16)
+            for i in range(len(target)):
+                self.assertAlmostEqual(
+                    float(test[i]), float(target[i]), places=2,
+                    msg='Error in bfloat16 donating rate calculation.'
+                )
+
+
 class TestTriad(unittest.TestCase):
     """ Test triad functionality. 
     """
@@ -315,4 +535,95 @@ class TestQuest(unittest.TestCase):
             self.assertAlmostEqual(
                 test_q[i], target_q[i],
                 msg='error in QUEST get_q calculation.'
-            )
\ No newline at end of file
+            )
+
+    def test_get_q_batched(self):
+        vb = jnp.array(
+            [[ 0.8273,  0.5541, -0.092 ],
+             [-0.8285,  0.5522, -0.0955]]
+        )
+        vn = jnp.array(
+            [[-0.1517, -0.9669,  0.205 ],
+             [-0.8393,  0.4494, -0.3044]]
+        )
+        w = jnp.array([1., 0.5])
+        W = jnp.stack([w, 2. * w])
+        VB = jnp.stack([vb, vn])
+        VN = jnp.stack([vn, vb])
+        target_q = jnp.stack([get_q(w, vb, vn), get_q(2. * w, vn, vb)])
+        for test_q in [get_q_batched(W, VB, VN), get_q_batched(W, VB, VN, n_iter=8)]:
+            for i in range(2):
+                for j in range(3):
+                    self.assertAlmostEqual(
+                        test_q[i, j], target_q[i, j], places=5,
+                        msg='error in QUEST get_q_batched calculation.'
+                    )
+
+    def test_get_q_n_iter_keyword_only(self):
+        vb = jnp.array(
+            [[ 0.8273,  0.5541, -0.092 ],
+             [-0.8285,  0.5522, -0.0955]]
+        )
+        vn = jnp.array(
+            [[-0.1517, -0.9669,  0.205 ],
+             [-0.8393,  0.4494, -0.3044]]
+        )
+        w = jnp.array([1., 0.5])
+        # The fourth positional argument used to be the float tolerance e.
+        with self.assertRaises(TypeError):
+            get_q(w, vb, vn, 1e-12)
+        with self.assertRaises(TypeError):
+            get_b(w, vb, vn, 1e-12)
+
+    def test_get_b(self):
+        vb = jnp.array(
+            [[ 0.8273,  0.5541, -0.092 ],
+             [-0.8285,  0.5522, -0.0955]]
+        )
+        vn = jnp.array(
+            [[-0.1517, -0.9669,  0.205 ],
+             [-0.8393,  0.4494, -0.3044]]
+        )
+        w = jnp.array([1., 0.5])
+        test_b = get_b(w, vb, vn)
+        target_b = jnp.array([0.02641338, -0.84095633, 0.50203993, -0.20012666])
+        for i in range(4):
+            self.assertAlmostEqual(
+                test_b[i], target_b[i], places=5,
+                msg='error in QUEST get_b calculation.'
+            )
+
+    def test_get_lam_power(self):
+        vb = jnp.array(
+            [[ 0.8273,  0.5541, -0.092 ],
+             [-0.8285,  0.5522, -0.0955]]
+        )
+        vn = jnp.array(
+            [[-0.1517, -0.9669,  0.205 ],
+             [-0.8393,  0.4494, -0.3044]]
+        )
+        w = jnp.array([1., 0.5])
+        test_lam = get_lam_power(w, get_K(w, vb, vn))
+        target_lam = 1.4997999664
+        self.assertAlmostEqual(
+            test_lam, target_lam, places=5,
+            msg='error in QUEST get_lam_power calculation.'
+        )
+
+    def test_get_lam_power_random(self):
+        """ Random rotations observed by 3 sensors, with and without noise.
+        """
+        rng = np.random.default_rng(0)
+        for noise in [0., 1e-2]:
+            for _ in range(50):
+                dcm = Quaternion(jnp.asarray(rng.normal(size=4))).dcm
+                vn = rng.normal(size=(3, 3))
+                vn /= np.linalg.norm(vn, axis=1, keepdims=True)
+                vb = vn @ np.asarray(dcm).T + noise * rng.normal(size=(3, 3))
+                vb /= np.linalg.norm(vb, axis=1, keepdims=True)
+                w = jnp.asarray(rng.uniform(0.1, 1., size=3), dtype=jnp.float32)
+                K = get_K(w, jnp.asarray(vb, dtype=jnp.float32), jnp.asarray(vn, dtype=jnp.float32))
+                self.assertAlmostEqual(
+                    get_lam_power(w, K), jnp.linalg.eigvalsh(K)[-1], places=5,
+                    msg='error in QUEST get_lam_power calculation.'
+                )